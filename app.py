@@ -2,18 +2,22 @@ from streamlit_file_browser import st_file_browser
 from typing import Optional
 from warnings import filterwarnings
 
+from toolkit.backend import create_state_backend
 from toolkit.database import (
-  connect_session, search_active_chats,
+  search_active_chats,
   create_chat_history, ChatHistory,
   update_chat_name, update_chat_status,
+  create_chat_usage, summarize_chat_usage, ChatUsage,
 )
 from toolkit.fileio import FileContext, create_cache_folder, save_uploaded_files
 from toolkit.chatbot import create_chatbot, init_chat_session
+from toolkit.tokens import PromptBudgetExceeded, TokenUsageCallback
 from toolkit.ui import render_human_prompt, render_message
 
 import dotenv
 import os
 import streamlit as st
+import time
 import uuid
 
 
@@ -21,14 +25,29 @@ import uuid
 filterwarnings('ignore', category=FutureWarning)
 dotenv.load_dotenv('.env', verbose=False)
 
+MODEL_NAME = 'gpt-4o-mini'
+EXECUTION_LOCK_TIMEOUT = 60.0
+
+
+# Shared resources, created once per process and shared by all sessions
+@st.cache_resource
+def get_state_backend():
+  return create_state_backend(os.getenv('STATE_BACKEND', 'local'))
+
+@st.cache_resource
+def get_chatbot():
+  return create_chatbot(
+    MODEL_NAME, get_state_backend(),
+    token_budget=int(os.getenv('TOKEN_BUDGET', '100000')),
+  )
+
+state_backend = get_state_backend()
+chatbot = get_chatbot()
+
 
 # Streamlit State Session
-if 'session_db' not in st.session_state:
-  st.session_state.session_db = connect_session(db_path=os.getenv('SESSION_DB'))
 if 'restore_id' not in st.session_state:
   st.session_state.restore_id = ''
-if 'chat_model' not in st.session_state:
-  st.session_state.chatbot = create_chatbot('gpt-4o-mini', os.getenv('MESSAGE_DB'))
 if 'browse_file' not in st.session_state:
   st.session_state.browse_file = False
 
@@ -37,32 +56,30 @@ if 'browse_file' not in st.session_state:
 def create_chat_cb(chat_name: str):
   st.session_state.restore_id = str(uuid.uuid4())
   chat_history = ChatHistory(
-    folder=create_cache_folder(cache_root=os.getenv('CACHE_ROOT'), prefix='chat-'),
+    folder=create_cache_folder(cache_root=state_backend.cache_root, prefix='chat-'),
     id=st.session_state.restore_id,
   )
   if chat_name:
     chat_history.name = chat_name
 
-  create_chat_history(st.session_state.session_db, chat_history=chat_history)
+  with state_backend.chat_session() as session:
+    create_chat_history(session, chat_history=chat_history)
   init_chat_session(
     session_id=st.session_state.restore_id,
-    message_db=os.getenv('MESSAGE_DB'),
+    state_backend=state_backend,
+    model_name=MODEL_NAME,
   )
 
 def rename_chat_cb(chat_name: str, chat_id: str):
   st.session_state.restore_id = chat_id
   if chat_name:
-    update_chat_name(
-      st.session_state.session_db,
-      chat_id=chat_id, name=chat_name,
-    )
+    with state_backend.chat_session() as session:
+      update_chat_name(session, chat_id=chat_id, name=chat_name)
 
 def delete_chat_cb(chat_id: str):
   st.session_state.restore_id = ''
-  update_chat_status(
-    st.session_state.session_db,
-    chat_id=chat_id, status='delete',
-  )
+  with state_backend.chat_session() as session:
+    update_chat_status(session, chat_id=chat_id, status='delete')
 
 def browse_file_cb():
   st.session_state.browse_file = not st.session_state.browse_file
@@ -72,6 +89,13 @@ def dismiss_file_cb():
 
 
 # Helper functions
+def format_file_size(size: int):
+  for unit in ['B', 'KB', 'MB', 'GB']:
+    if size < 1024 or unit == 'GB':
+      break
+    size /= 1024
+  return f'{size:.0f} {unit}' if unit == 'B' else f'{size:.1f} {unit}'
+
 def format_user_message(user_inputs: dict):
   user_message = user_inputs['text']
   if user_inputs['files']:
@@ -79,7 +103,7 @@ def format_user_message(user_inputs: dict):
     for file in user_inputs['files']:
       status = user_inputs['status'][file.name]
       if status[0]:
-        entry = f'- {file.name}: {file.type}, success.'
+        entry = f'- {file.name}: {file.type}, {format_file_size(status[1])}, success.'
       else:
         failure_details = f'failure ({status[1]}, {status[2]})'
         entry = f'- {file.name}: {file.type}, {failure_details}.'
@@ -119,7 +143,8 @@ def streamlit_sidebar():
     st.title('Chat with DataFrame')
 
     # Select from a list of active chat sessions
-    chat_history_list = search_active_chats(st.session_state.session_db)
+    with state_backend.chat_session() as session:
+      chat_history_list = search_active_chats(session)
     if chat_history_list:
       chat_history = st.selectbox(
         label='Active Chat Sessions',
@@ -170,14 +195,24 @@ def streamlit_sidebar():
 
     if session_id and st.button('Browse Files', width='stretch', on_click=browse_file_cb):
       if st.session_state.browse_file:
-        streamlit_file_browser(cache_root=os.getenv('CACHE_ROOT'), folder=chat_history.folder)
+        streamlit_file_browser(cache_root=state_backend.cache_root, folder=chat_history.folder)
 
   return session_id, chat_history
 
+def streamlit_chat_usage(session_id: str):
+  with state_backend.chat_session() as session:
+    usage = summarize_chat_usage(session, chat_id=session_id)
+  with st.sidebar:
+    st.caption(
+      f'**Usage** — {usage["turns"]} turns, '
+      f'{usage["prompt_tokens"]:,} prompt / {usage["completion_tokens"]:,} completion tokens, '
+      f'{usage["latency"]:.1f}s total latency'
+    )
+
 def streamlit_content(session_id: str, chat_history: Optional[ChatHistory]):
-  FileContext.get_instance(cache_root=os.getenv('CACHE_ROOT'), folder=chat_history.folder)
+  FileContext.get_instance(cache_root=state_backend.cache_root, folder=chat_history.folder)
 
-  session_history = st.session_state.chatbot.get_session_history(session_id)
+  session_history = chatbot.get_session_history(session_id)
   for message in session_history.get_messages():
     render_message(message)
 
@@ -186,7 +221,7 @@ def streamlit_content(session_id: str, chat_history: Optional[ChatHistory]):
     if user_inputs['files']:
       with st.spinner('Caching uploaded files...', show_time=True, width='stretch'):
         file_status = save_uploaded_files(
-          cache_root=os.getenv('CACHE_ROOT'),
+          cache_root=state_backend.cache_root,
           folder=chat_history.folder, files=user_inputs['files'],
         )
       user_inputs['status'] = file_status
@@ -194,17 +229,33 @@ def streamlit_content(session_id: str, chat_history: Optional[ChatHistory]):
     user_message = format_user_message(user_inputs)
     render_human_prompt(user_message)
 
-    stream = st.session_state.chatbot.stream(
+    usage_cb = TokenUsageCallback(MODEL_NAME)
+    turn_start = time.perf_counter()
+
+    stream = chatbot.stream(
       {'message': user_message},
-      config={'configurable': {'session_id': session_id}},
+      config={'configurable': {'session_id': session_id}, 'callbacks': [usage_cb]},
     )
-    for message in stream:
-      render_message(message)
+    try:
+      with state_backend.execution_lock(session_id, timeout=EXECUTION_LOCK_TIMEOUT):
+        for message in stream:
+          render_message(message)
+    except (PromptBudgetExceeded, TimeoutError) as ex:
+      st.error(str(ex), icon=':material/error:')
+
+    with state_backend.chat_session() as session:
+      create_chat_usage(session, chat_usage=ChatUsage(
+        chat_id=session_id,
+        prompt_tokens=usage_cb.prompt_tokens,
+        completion_tokens=usage_cb.completion_tokens,
+        latency=time.perf_counter() - turn_start,
+      ))
 
 
 # Streamlit App
 session_id, chat_history = streamlit_sidebar()
 if session_id:
   streamlit_content(session_id, chat_history)
+  streamlit_chat_usage(session_id)
 else:
   streamlit_welcome()
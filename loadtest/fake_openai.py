@@ -0,0 +1,154 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from typing import Dict, List
+
+import json
+import re
+import time
+import uuid
+
+
+ANALYSIS_SCRIPT = '''
+import pandas as pd
+
+df = pd.read_csv({filename!r})
+print(df.describe(include='all').to_string())
+'''
+
+
+def _tool_call(name: str, args: Dict) -> Dict:
+  return dict(
+    id=f'call_{uuid.uuid4().hex[:24]}', type='function',
+    function=dict(name=name, arguments=json.dumps(args)),
+  )
+
+
+def scripted_reply(messages: List[Dict]) -> Dict:
+  '''Choose the next assistant message of a scripted analysis turn.
+
+  A user message is answered by saving an analysis script for the CSV file
+  it mentions, the saved script is then executed, and the execution result
+  is summarized. This drives every tool of the chatbot once per turn.
+  '''
+
+  last = messages[-1]
+
+  if last['role'] == 'tool':
+    calls = {
+      call['id']: call['function']['name']
+      for message in messages if message['role'] == 'assistant'
+      for call in message.get('tool_calls') or []
+    }
+    if calls.get(last['tool_call_id']) == 'save_generation':
+      script = json.loads(last['content'])['filename']
+      return dict(content='', tool_calls=[_tool_call('code_execution', dict(path=script))])
+    return dict(content=f'The script finished, here is a summary:\n\n{last["content"][:200]}')
+
+  files = re.findall(r'[\w.-]+\.csv', str(last.get('content', '')))
+  if not files:
+    return dict(content='Could you upload a CSV file for me to analyze?')
+
+  script = ANALYSIS_SCRIPT.format(filename=files[-1]).strip()
+  args = dict(text=script, filename=f'analysis-{uuid.uuid4().hex[:8]}.py', code=True)
+  return dict(content='', tool_calls=[_tool_call('save_generation', args)])
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+  server_version = 'FakeOpenAI/0.1'
+
+  def log_message(self, format, *args):
+    pass
+
+  def do_POST(self):
+    if not self.path.rstrip('/').endswith('/chat/completions'):
+      self.send_error(404)
+      return
+
+    length = int(self.headers.get('Content-Length', 0))
+    request = json.loads(self.rfile.read(length))
+
+    time.sleep(self.server.model_latency)
+    reply = scripted_reply(request['messages'])
+
+    if request.get('stream'):
+      self._send_stream(request['model'], reply)
+    else:
+      self._send_completion(request['model'], reply)
+
+  def _completion_meta(self, model: str, object: str) -> Dict:
+    return dict(
+      id=f'chatcmpl-{uuid.uuid4().hex}', object=object,
+      created=int(time.time()), model=model,
+    )
+
+  def _send_completion(self, model: str, reply: Dict):
+    message = dict(role='assistant', content=reply['content'])
+    if reply.get('tool_calls'):
+      message['tool_calls'] = reply['tool_calls']
+
+    body = json.dumps(dict(
+      **self._completion_meta(model, 'chat.completion'),
+      choices=[dict(
+        index=0, message=message,
+        finish_reason='tool_calls' if reply.get('tool_calls') else 'stop',
+      )],
+      usage=dict(prompt_tokens=0, completion_tokens=0, total_tokens=0),
+    )).encode('utf-8')
+
+    self.send_response(200)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def _send_stream(self, model: str, reply: Dict):
+    meta = self._completion_meta(model, 'chat.completion.chunk')
+    tool_calls = reply.get('tool_calls') or []
+
+    delta = dict(role='assistant', content=reply['content'])
+    if tool_calls:
+      delta['tool_calls'] = [dict(index=idx, **call) for idx, call in enumerate(tool_calls)]
+
+    chunks = [
+      dict(index=0, delta=delta, finish_reason=None),
+      dict(index=0, delta={}, finish_reason='tool_calls' if tool_calls else 'stop'),
+    ]
+
+    self.send_response(200)
+    self.send_header('Content-Type', 'text/event-stream')
+    self.end_headers()
+    for choice in chunks:
+      payload = json.dumps(dict(**meta, choices=[choice]))
+      self.wfile.write(f'data: {payload}\n\n'.encode('utf-8'))
+    self.wfile.write(b'data: [DONE]\n\n')
+
+
+def start_server(host: str = '127.0.0.1', port: int = 0, model_latency: float = 0.0):
+  '''Serve the fake API in a daemon thread, return the server and its base URL.'''
+
+  server = ThreadingHTTPServer((host, port), FakeOpenAIHandler)
+  server.daemon_threads = True
+  server.model_latency = model_latency
+
+  Thread(target=server.serve_forever, daemon=True).start()
+
+  return server, f'http://{host}:{server.server_address[1]}/v1'
+
+
+if __name__ == '__main__':
+  import argparse
+
+  parser = argparse.ArgumentParser(description='OpenAI-compatible stand-in server.')
+  parser.add_argument('--host', default='127.0.0.1')
+  parser.add_argument('--port', type=int, default=8000)
+  parser.add_argument('--model-latency', type=float, default=0.0,
+                      help='Seconds to wait before each reply.')
+  args = parser.parse_args()
+
+  server, base_url = start_server(args.host, args.port, args.model_latency)
+  print(f'Serving at OPENAI_BASE_URL={base_url}', flush=True)
+  try:
+    while True:
+      time.sleep(3600)
+  except KeyboardInterrupt:
+    server.shutdown()
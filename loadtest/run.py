@@ -0,0 +1,211 @@
+from concurrent.futures import ThreadPoolExecutor
+from langchain_core.messages import ToolMessage
+from typing import Dict, List
+
+from toolkit.backend import LocalStateBackend
+from toolkit.chatbot import create_chatbot, init_chat_session
+from toolkit.database import ChatHistory, ChatUsage, create_chat_history, create_chat_usage
+from toolkit.fileio import FileContext, create_cache_folder, save_uploaded_files
+from toolkit.tokens import TokenUsageCallback
+from toolkit.tools import code_execution
+
+import argparse
+import io
+import json
+import math
+import os
+import random
+import tempfile
+import time
+import uuid
+
+
+MODEL_NAME = 'gpt-4o-mini'
+EXECUTION_LOCK_TIMEOUT = 60.0
+
+
+def make_csv(rows: int, seed: int) -> io.BytesIO:
+  rng = random.Random(seed)
+  lines = ['id,group,value,score']
+  for idx in range(rows):
+    lines.append(f'{idx},{rng.choice("ABCDE")},{rng.gauss(0, 1):.4f},{rng.randint(0, 100)}')
+
+  file = io.BytesIO('\n'.join(lines).encode('utf-8'))
+  file.name = 'data.csv'
+
+  return file
+
+
+def percentile(values: List[float], q: float) -> float:
+  if not values:
+    return float('nan')
+  ordered = sorted(values)
+  return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def failed_execution(message) -> bool:
+  if not isinstance(message, ToolMessage):
+    return False
+  if message.additional_kwargs.get('name') != code_execution.name:
+    return False
+  return json.loads(message.content)['status'].startswith('Failure')
+
+
+def simulate_user(chatbot, state_backend, turns: int, rows: int, seed: int) -> List[Dict]:
+  '''Create a chat, upload a CSV and run a scripted multi-turn conversation.
+
+  Errors are recorded per turn rather than raised, so that one failing user
+  does not abort the whole level. If the setup fails, every turn fails.
+  '''
+
+  session_id = str(uuid.uuid4())
+  file = make_csv(rows, seed)
+
+  try:
+    chat_history = ChatHistory(
+      folder=create_cache_folder(cache_root=state_backend.cache_root, prefix='chat-'),
+      id=session_id,
+    )
+    with state_backend.chat_session() as session:
+      create_chat_history(session, chat_history=chat_history)
+    init_chat_session(session_id=session_id, state_backend=state_backend, model_name=MODEL_NAME)
+
+    uploaded, *details = save_uploaded_files(state_backend.cache_root, chat_history.folder, [file])[file.name]
+    setup_error = None if uploaded else details[0]
+  except Exception as ex:
+    setup_error = type(ex).__name__
+
+  if setup_error is not None:
+    return [dict(latency=0.0, error=f'setup {setup_error}') for _ in range(turns)]
+
+  results = []
+  for turn in range(turns):
+    FileContext.get_instance(cache_root=state_backend.cache_root, folder=chat_history.folder)
+    usage_cb = TokenUsageCallback(MODEL_NAME)
+    message = f'Turn {turn}: please summarize the columns of {file.name}.'
+
+    turn_start, error = time.perf_counter(), None
+    try:
+      with state_backend.execution_lock(session_id, timeout=EXECUTION_LOCK_TIMEOUT):
+        stream = chatbot.stream(
+          {'message': message},
+          config={'configurable': {'session_id': session_id}, 'callbacks': [usage_cb]},
+        )
+        for output in stream:
+          if failed_execution(output):
+            error = 'code_execution failure'
+    except Exception as ex:
+      error = type(ex).__name__
+    latency = time.perf_counter() - turn_start
+
+    try:
+      with state_backend.chat_session() as session:
+        create_chat_usage(session, chat_usage=ChatUsage(
+          chat_id=session_id,
+          prompt_tokens=usage_cb.prompt_tokens,
+          completion_tokens=usage_cb.completion_tokens,
+          latency=latency,
+        ))
+    except Exception as ex:
+      error = error or f'usage {type(ex).__name__}'
+
+    results.append(dict(latency=latency, error=error))
+
+  return results
+
+
+def run_level(chatbot, state_backend, users: int, turns: int, rows: int) -> Dict:
+  started = time.perf_counter()
+  with ThreadPoolExecutor(max_workers=users) as executor:
+    futures = [
+      executor.submit(simulate_user, chatbot, state_backend, turns, rows, seed)
+      for seed in range(users)
+    ]
+    results = [result for future in futures for result in future.result()]
+  elapsed = time.perf_counter() - started
+
+  latencies = [r['latency'] for r in results if r['error'] is None]
+  errors = [r['error'] for r in results if r['error'] is not None]
+
+  return dict(
+    users=users, turns=len(results), elapsed=elapsed,
+    throughput=len(results) / elapsed,
+    p50=percentile(latencies, 50),
+    p95=percentile(latencies, 95),
+    p99=percentile(latencies, 99),
+    error_rate=len(errors) / len(results),
+    errors=sorted(set(errors)),
+  )
+
+
+def format_report(reports: List[Dict]) -> str:
+  header = f'{"users":>6} {"turns":>6} {"turns/s":>8} {"p50 s":>7} {"p95 s":>7} {"p99 s":>7} {"errors":>7}'
+  lines = [header, '-' * len(header)]
+  for r in reports:
+    lines.append(
+      f'{r["users"]:>6} {r["turns"]:>6} {r["throughput"]:>8.2f} '
+      f'{r["p50"]:>7.2f} {r["p95"]:>7.2f} {r["p99"]:>7.2f} {r["error_rate"]:>7.1%}'
+      + (f'  {", ".join(r["errors"])}' if r['errors'] else '')
+    )
+  return '\n'.join(lines)
+
+
+def run_levels(args: argparse.Namespace, workdir: str):
+  state_backend = LocalStateBackend(
+    session_db=os.path.join(workdir, 'session.db'),
+    message_db=os.path.join(workdir, 'message.db'),
+    cache_root=os.path.join(workdir, 'cache'),
+  )
+  chatbot = create_chatbot(MODEL_NAME, state_backend, token_budget=100000)
+
+  print(f'Model server: {args.base_url}, working folder: {workdir}', flush=True)
+
+  reports = []
+  for users in args.users:
+    reports.append(run_level(chatbot, state_backend, users, args.turns, args.rows))
+    print(format_report(reports[-1:]).splitlines()[-1], flush=True)
+
+  print()
+  print(format_report(reports))
+
+
+def positive_int(value: str) -> int:
+  number = int(value)
+  if number < 1:
+    raise argparse.ArgumentTypeError(f'expected a positive integer, got {value}')
+  return number
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Multi-user load test of the chatbot.')
+  parser.add_argument('--users', type=lambda v: [positive_int(u) for u in v.split(',')],
+                      default='1,2,4,8,16',
+                      help='Comma separated concurrency levels.')
+  parser.add_argument('--turns', type=positive_int, default=3, help='Turns per user.')
+  parser.add_argument('--rows', type=int, default=1000, help='Rows of the uploaded CSV.')
+  parser.add_argument('--model-latency', type=float, default=0.2,
+                      help='Seconds the fake server waits before each reply.')
+  parser.add_argument('--base-url', default=None,
+                      help='Use a running OpenAI-compatible server instead of the fake one.')
+  parser.add_argument('--workdir', default=None,
+                      help='Folder for databases and chat files (default: temporary).')
+  args = parser.parse_args()
+
+  if args.base_url is None:
+    from loadtest.fake_openai import start_server
+    _, args.base_url = start_server(model_latency=args.model_latency)
+
+  os.environ['OPENAI_BASE_URL'] = args.base_url
+  os.environ.setdefault('OPENAI_API_KEY', 'sk-loadtest')
+
+  if args.workdir is not None:
+    run_levels(args, args.workdir)
+    return
+
+  # SQLite files may still be open on Windows, leave them to the OS then
+  with tempfile.TemporaryDirectory(prefix='loadtest-', ignore_cleanup_errors=True) as workdir:
+    run_levels(args, workdir)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,111 @@
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from langchain_core.chat_history import BaseChatMessageHistory
+from sqlalchemy.orm import Session
+from typing import Callable, Dict, Iterator, Type
+
+from toolkit.database import create_sqlite_engine, connect_session
+from toolkit.fileio import file_lock
+from toolkit.history import TokenCountedChatMessageHistory, create_message_table
+
+import os
+
+
+LOCK_FOLDER = '.locks'
+SCHEMA_LOCK_TIMEOUT = 60.0
+
+
+class StateBackend(ABC):
+  '''Shared state of the app: chat metadata, message history and execution locks.
+
+  A backend is created once per process and shared by all Streamlit sessions.
+  Every piece of state that decides how a chat is served lives here, so that
+  any worker process behind a load balancer can serve any chat. Uploaded
+  files live under `cache_root`, which must be reachable by all workers.
+  '''
+
+  def __init__(self, cache_root: str):
+    self.cache_root = cache_root
+
+  @classmethod
+  @abstractmethod
+  def from_env(cls) -> 'StateBackend':
+    '''Create the backend from environment variables.'''
+
+  @abstractmethod
+  def chat_session(self) -> Session:
+    '''Open a new ORM session on the chat metadata store.'''
+
+  @abstractmethod
+  def message_history(self, session_id: str, model_name: str) -> BaseChatMessageHistory:
+    '''Message history of the chat.'''
+
+  @abstractmethod
+  def execution_lock(self, chat_id: str, timeout: float) -> Iterator[None]:
+    '''Context manager that serializes chat turns across all workers.
+
+    Raises `TimeoutError` if the lock cannot be acquired within `timeout` seconds.
+    '''
+
+
+class LocalStateBackend(StateBackend):
+  '''SQLite databases and file locks, shared by processes on a single host.
+
+  The databases run in WAL mode, whose shared-memory index does not work
+  over network filesystems, so the files must stay on a local disk. To run
+  workers on several hosts, register a networked backend, ie. one that keeps
+  metadata and messages in a SQL server and locks in a key-value store.
+  '''
+
+  def __init__(self, session_db: str, message_db: str, cache_root: str):
+    super().__init__(cache_root)
+
+    session_engine = create_sqlite_engine(session_db)
+    self.message_engine = create_sqlite_engine(message_db)
+
+    # Workers may start together, so set up each schema under a lock
+    with file_lock(f'{os.path.abspath(session_db)}.lock', SCHEMA_LOCK_TIMEOUT):
+      self.session_maker = connect_session(session_engine)
+    with file_lock(f'{os.path.abspath(message_db)}.lock', SCHEMA_LOCK_TIMEOUT):
+      create_message_table(self.message_engine)
+
+    self.lock_root = os.path.join(os.path.abspath(cache_root), LOCK_FOLDER)
+    os.makedirs(self.lock_root, exist_ok=True)
+
+  @classmethod
+  def from_env(cls) -> 'LocalStateBackend':
+    return cls(
+      session_db=os.getenv('SESSION_DB'),
+      message_db=os.getenv('MESSAGE_DB'),
+      cache_root=os.getenv('CACHE_ROOT'),
+    )
+
+  def chat_session(self) -> Session:
+    return self.session_maker()
+
+  def message_history(self, session_id: str, model_name: str) -> BaseChatMessageHistory:
+    return TokenCountedChatMessageHistory(session_id, self.message_engine, model_name)
+
+  @contextmanager
+  def execution_lock(self, chat_id: str, timeout: float):
+    lock_path = os.path.join(self.lock_root, f'{chat_id}.lock')
+    with file_lock(lock_path, timeout, busy_message=f'Chat {chat_id} is busy in another session'):
+      yield
+
+
+STATE_BACKENDS: Dict[str, Type[StateBackend]] = {
+  'local': LocalStateBackend,
+}
+
+
+def register_state_backend(name: str) -> Callable[[Type[StateBackend]], Type[StateBackend]]:
+  def _register(backend_cls: Type[StateBackend]):
+    STATE_BACKENDS[name] = backend_cls
+    return backend_cls
+  return _register
+
+
+def create_state_backend(name: str) -> StateBackend:
+  if name not in STATE_BACKENDS:
+    raise ValueError(f'Unknown state backend: {name}')
+  return STATE_BACKENDS[name].from_env()
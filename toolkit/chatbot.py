@@ -3,25 +3,26 @@ from langchain_core.prompts import (
   HumanMessagePromptTemplate,
   SystemMessagePromptTemplate,
 )
-from langchain.agents import AgentExecutor, create_tool_calling_agent
+from langchain.agents import AgentExecutor
 from langchain.agents.format_scratchpad.tools import format_to_tool_messages
-from langchain.agents.output_parsers.tools import ToolAgentAction
+from langchain.agents.output_parsers.tools import ToolAgentAction, ToolsAgentOutputParser
 from langchain_core.agents import AgentStep
 # from langchain_core.callbacks import CallbackManager
 from langchain_core.messages import BaseMessage, AIMessageChunk, ToolMessage
-from langchain_core.runnables import Runnable
+from langchain_core.runnables import Runnable, RunnableLambda, RunnablePassthrough
 from langchain_core.runnables.config import RunnableConfig
 from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain_community.chat_message_histories import SQLChatMessageHistory
 from langchain_openai.chat_models import ChatOpenAI
 from typing import Any, Dict, Iterator, List, Optional
 
+from toolkit.backend import StateBackend
 from toolkit.prompt import (
   CHATBOT_SYSTEM_PROMPT_TEMPLATE,
   DEFAULT_TOOL_GUIDELINES,
   DEFAULT_GUIDELINES,
   CONVERSATION_OPENINGS,
 )
+from toolkit.tokens import PromptBudget
 from toolkit.tools import get_tools
 
 import json
@@ -112,13 +113,15 @@ class AgentExecutorAdapter(Runnable):
     # run_manager.on_chain_end(messages)
 
 
-def create_prompt(tool_guidelines: str, guidelines: str):
-  system_prompt = SystemMessagePromptTemplate.from_template(
-    CHATBOT_SYSTEM_PROMPT_TEMPLATE.format(
-      tool_guidelines=tool_guidelines,
-      guidelines=guidelines,
-    ),
+def create_system_prompt(tool_guidelines: str, guidelines: str):
+  return CHATBOT_SYSTEM_PROMPT_TEMPLATE.format(
+    tool_guidelines=tool_guidelines,
+    guidelines=guidelines,
   )
+
+
+def create_prompt(system_prompt: str):
+  system_prompt = SystemMessagePromptTemplate.from_template(system_prompt)
   chat_history = MessagesPlaceholder(variable_name='history')
   human_prompt = HumanMessagePromptTemplate.from_template('{message}')
   scratch_pad = MessagesPlaceholder(variable_name='agent_scratchpad')
@@ -128,25 +131,41 @@ def create_prompt(tool_guidelines: str, guidelines: str):
   return ChatPromptTemplate.from_messages(messages)
 
 
-def init_chat_session(session_id: str, message_db: str):
-  session_history = SQLChatMessageHistory(session_id, connection=f'sqlite:///{message_db}')
+def create_agent(model: ChatOpenAI, prompt: ChatPromptTemplate, budget: PromptBudget):
+  # Same as `create_tool_calling_agent`, with a budget check before sending
+  return (
+    RunnablePassthrough.assign(
+      agent_scratchpad=lambda x: format_to_tool_messages(x['intermediate_steps']),
+    )
+    | RunnableLambda(budget)
+    | prompt
+    | model.bind_tools(get_tools())
+    | ToolsAgentOutputParser()
+  )
+
+
+def init_chat_session(session_id: str, state_backend: StateBackend, model_name: str):
+  session_history = state_backend.message_history(session_id, model_name)
   session_history.add_ai_message(random.choice(CONVERSATION_OPENINGS))
 
 
-def create_chatbot(model_name: str, message_db: str, **kwargs):
+def create_chatbot(model_name: str, state_backend: StateBackend, token_budget: int, **kwargs):
   model = ChatOpenAI(model=model_name, **kwargs)
 
-  prompt = create_prompt(
+  system_prompt = create_system_prompt(
     tool_guidelines=DEFAULT_TOOL_GUIDELINES.strip(),
     guidelines=DEFAULT_GUIDELINES.strip(),
   )
-  agent = create_tool_calling_agent(model, get_tools(), prompt)
+  prompt = create_prompt(system_prompt)
+  budget = PromptBudget(model_name, token_budget, system_prompt, tools=get_tools())
+
+  agent = create_agent(model, prompt, budget)
   agent_executor = AgentExecutor(agent=agent, tools=get_tools())
 
   chatbot = RunnableWithMessageHistory(
     runnable=AgentExecutorAdapter(agent_executor),
     get_session_history=lambda session_id: (
-      SQLChatMessageHistory(session_id, connection=f'sqlite:///{message_db}')
+      state_backend.message_history(session_id, model_name)
     ),
     input_messages_key='message',
     history_messages_key='history',
@@ -0,0 +1,194 @@
+'''Out-of-core helpers for CSV files larger than memory.
+
+Generated scripts import this module, ie. `from toolkit import chunked`.
+Every helper streams the file in chunks, so peak memory is bounded by the
+chunk size rather than the file size.
+'''
+
+from typing import Iterator, List, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+
+DEFAULT_CHUNKSIZE = 100_000
+
+
+def _update_reservoir(sample, keys, chunk, n, rng):
+  candidates = pd.concat([sample, chunk]) if sample is not None else chunk
+  keys = np.concatenate([keys, rng.random(len(chunk))])
+
+  keep = np.argsort(keys, kind='stable')[:n]
+  return candidates.iloc[keep], keys[keep]
+
+
+def _to_numeric(chunk: pd.DataFrame, columns: List[str]) -> pd.DataFrame:
+  # Chunks infer dtypes independently, values that are not numbers become NaN
+  return chunk[columns].apply(pd.to_numeric, errors='coerce')
+
+
+def _pin_key_dtypes(kwargs: dict, keys: List[str]):
+  # Chunks infer dtypes independently, so the same key could be read as 0 and '0'
+  dtype = kwargs.get('dtype')
+  if dtype is None:
+    kwargs['dtype'] = {key: str for key in keys}
+  elif isinstance(dtype, dict):
+    kwargs['dtype'] = {**{key: str for key in keys}, **dtype}
+
+
+def read_chunks(path: str, chunksize: int = DEFAULT_CHUNKSIZE, **kwargs) -> Iterator[pd.DataFrame]:
+  '''Iterate over the CSV file in chunks of `chunksize` rows.
+
+  Keyword arguments are forwarded to `pd.read_csv`, ie. `usecols`, `dtype`.
+  Selecting only the needed columns with `usecols` saves most memory.
+  '''
+
+  with pd.read_csv(path, chunksize=chunksize, **kwargs) as reader:
+    yield from reader
+
+
+def groupby_agg(
+  path: str, by: Union[str, List[str]], columns: Union[str, List[str]],
+  aggs: Sequence[str] = ('sum', 'count', 'mean'),
+  chunksize: int = DEFAULT_CHUNKSIZE, **kwargs,
+) -> pd.DataFrame:
+  '''Group by `by` and aggregate `columns` with sum, count and/or mean.
+
+  Partial sums and counts are combined across chunks, the mean is derived
+  from them at the end. Returns a frame with one column per (column, agg).
+  Values of `columns` that are not numbers are treated as missing. Keys are
+  read as strings, so that a group never splits across chunks; pass `dtype`
+  for the `by` columns to override.
+  '''
+
+  by = [by] if isinstance(by, str) else list(by)
+  columns = [columns] if isinstance(columns, str) else list(columns)
+
+  unknown = set(aggs) - {'sum', 'count', 'mean'}
+  if unknown:
+    raise ValueError(f'Unsupported aggregations: {sorted(unknown)}')
+
+  kwargs.setdefault('usecols', by + columns)
+  _pin_key_dtypes(kwargs, by)
+
+  partials = []
+  for chunk in read_chunks(path, chunksize, **kwargs):
+    chunk = pd.concat([chunk[by], _to_numeric(chunk, columns)], axis=1)
+    grouped = chunk.groupby(by, observed=True, dropna=False)[columns]
+    partials.append(pd.concat(dict(sum=grouped.sum(), count=grouped.count()), axis=1))
+
+    # Keep a single partial result, so memory is bounded by the number of groups
+    if len(partials) > 1:
+      partials = [pd.concat(partials).groupby(level=by, dropna=False).sum()]
+
+  if not partials:
+    return pd.DataFrame()
+
+  totals = partials[0]
+  result = {}
+  for column in columns:
+    for agg in aggs:
+      if agg == 'mean':
+        result[(column, agg)] = totals[('sum', column)] / totals[('count', column)]
+      else:
+        result[(column, agg)] = totals[(agg, column)]
+
+  return pd.DataFrame(result)
+
+
+def value_counts(
+  path: str, column: str, dropna: bool = True,
+  chunksize: int = DEFAULT_CHUNKSIZE, **kwargs,
+) -> pd.Series:
+  '''Count the occurrences of each value of `column`, sorted by frequency.
+
+  Values are read as strings, so that a value never splits across chunks;
+  pass `dtype` for `column` to override.
+  '''
+
+  kwargs.setdefault('usecols', [column])
+  _pin_key_dtypes(kwargs, [column])
+
+  counts = None
+  for chunk in read_chunks(path, chunksize, **kwargs):
+    partial = chunk[column].value_counts(dropna=dropna)
+    counts = partial if counts is None else counts.add(partial, fill_value=0)
+
+  if counts is None:
+    return pd.Series(dtype='int64', name='count')
+
+  return counts.astype('int64').sort_values(ascending=False)
+
+
+def reservoir_sample(
+  path: str, n: int, seed: Optional[int] = None,
+  chunksize: int = DEFAULT_CHUNKSIZE, **kwargs,
+) -> pd.DataFrame:
+  '''Sample `n` rows uniformly at random, without replacement.
+
+  Every row gets a random key, and the rows with the `n` smallest keys seen
+  so far are kept. This is equivalent to reservoir sampling, vectorized per chunk.
+  '''
+
+  rng = np.random.default_rng(seed)
+
+  sample, keys = None, np.empty(0)
+  for chunk in read_chunks(path, chunksize, **kwargs):
+    sample, keys = _update_reservoir(sample, keys, chunk, n, rng)
+
+  if sample is None:
+    return pd.DataFrame()
+
+  return sample.sort_index()
+
+
+def describe(
+  path: str, sample_size: int = 100_000, seed: Optional[int] = None,
+  chunksize: int = DEFAULT_CHUNKSIZE, **kwargs,
+) -> pd.DataFrame:
+  '''Summary statistics of the numeric columns, like `DataFrame.describe`.
+
+  Count, mean, std, min and max are exact. The 25%, 50% and 75% percentiles
+  are estimated from a reservoir sample of `sample_size` rows. Numeric columns
+  are those of the first chunk, later values that are not numbers are counted
+  as missing. Pass `dtype` to fix the column types up front.
+  '''
+
+  rng = np.random.default_rng(seed)
+
+  columns = count = total = squares = minimum = maximum = None
+  sample, keys = None, np.empty(0)
+
+  for chunk in read_chunks(path, chunksize, **kwargs):
+    if columns is None:
+      columns = list(chunk.select_dtypes(include='number').columns)
+    numeric = _to_numeric(chunk, columns)
+
+    # Shift by the first chunk's mean to keep the sum of squares stable
+    if count is None:
+      shift = numeric.mean().fillna(0)
+      count = numeric.count()
+      total = (numeric - shift).sum()
+      squares = ((numeric - shift) ** 2).sum()
+      minimum, maximum = numeric.min(), numeric.max()
+    else:
+      count = count.add(numeric.count(), fill_value=0)
+      total = total.add((numeric - shift).sum(), fill_value=0)
+      squares = squares.add(((numeric - shift) ** 2).sum(), fill_value=0)
+      minimum = minimum.combine(numeric.min(), np.fmin)
+      maximum = maximum.combine(numeric.max(), np.fmax)
+
+    sample, keys = _update_reservoir(sample, keys, numeric, sample_size, rng)
+
+  if count is None:
+    return pd.DataFrame()
+
+  mean = total / count
+  std = np.sqrt((squares - count * mean ** 2) / (count - 1))
+  quantiles = sample.quantile([0.25, 0.5, 0.75])
+
+  return pd.DataFrame({
+    'count': count, 'mean': mean + shift, 'std': std, 'min': minimum,
+    '25%': quantiles.loc[0.25], '50%': quantiles.loc[0.5], '75%': quantiles.loc[0.75],
+    'max': maximum,
+  }).T
@@ -1,5 +1,6 @@
-from sqlalchemy import create_engine, Column, String, DateTime
+from sqlalchemy import create_engine, event, func, Column, String, DateTime, Integer, Float
 from sqlalchemy.orm import declarative_base
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime, timezone
 
@@ -28,19 +29,56 @@ class ChatHistory(Base):
   status = Column(String(20), default='active')
 
 
-def connect_session(db_path: str):
+class ChatUsage(Base):
+  __tablename__ = 'chat_usage'
+
+  id = Column(Integer, primary_key=True)
+  chat_id = Column(String(36), index=True, nullable=False)
+
+  created = Column(DateTime, default=time_fn, nullable=False)
+
+  prompt_tokens = Column(Integer, default=0, nullable=False)
+  completion_tokens = Column(Integer, default=0, nullable=False)
+  latency = Column(Float, default=0.0, nullable=False)
+
+
+def create_sqlite_engine(db_path: str, timeout: float = 30.0):
   db_path = os.path.abspath(db_path)
 
   db_root = os.path.dirname(db_path)
   if db_root and not os.path.exists(db_root):
     os.makedirs(db_root, exist_ok=True)
 
-  engine = create_engine(f'sqlite:///{db_path}', echo=False)
-  Base.metadata.create_all(engine, checkfirst=True)
+  engine = create_engine(
+    f'sqlite:///{db_path}', echo=False,
+    connect_args=dict(timeout=timeout, check_same_thread=False),
+  )
+
+  # Readers do not block the writer, so several processes can share the file
+  @event.listens_for(engine, 'connect')
+  def _set_sqlite_pragma(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.close()
+
+  return engine
 
-  Session = sessionmaker(bind=engine)
 
-  return Session()
+def is_schema_conflict(ex: OperationalError) -> bool:
+  # Another process created the same table or column in the meantime
+  message = str(ex.orig).lower()
+  return 'already exists' in message or 'duplicate column' in message
+
+
+def connect_session(engine):
+  try:
+    Base.metadata.create_all(engine, checkfirst=True)
+  except OperationalError as ex:
+    if not is_schema_conflict(ex):
+      raise
+
+  return sessionmaker(bind=engine, expire_on_commit=False)
 
 
 def search_active_chats(session):
@@ -80,3 +118,24 @@ def update_chat_status(session, chat_id: str, status: str):
     return True
 
   return False
+
+
+def create_chat_usage(session, chat_usage: ChatUsage):
+  session.add(chat_usage)
+  session.commit()
+
+
+def summarize_chat_usage(session, chat_id: str):
+  turns, prompt_tokens, completion_tokens, latency = session.query(
+    func.count(ChatUsage.id),
+    func.coalesce(func.sum(ChatUsage.prompt_tokens), 0),
+    func.coalesce(func.sum(ChatUsage.completion_tokens), 0),
+    func.coalesce(func.sum(ChatUsage.latency), 0.0),
+  ).filter(
+    ChatUsage.chat_id == chat_id
+  ).one()
+
+  return dict(
+    turns=turns, prompt_tokens=prompt_tokens,
+    completion_tokens=completion_tokens, latency=latency,
+  )
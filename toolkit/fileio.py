@@ -1,23 +1,43 @@
-from typing import Dict, List
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional
 
 import io
 import os
 import tempfile
+import time
 
+if os.name == 'nt':
+  import msvcrt
 
-HIDDEN_FOLDER = '.hidden'
+  def _try_lock(fd: int):
+    os.lseek(fd, 0, os.SEEK_SET)
+    msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
 
+  def _unlock(fd: int):
+    os.lseek(fd, 0, os.SEEK_SET)
+    msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
 
-class FileContext:
-  _instance = None
+else:
+  import fcntl
+
+  def _try_lock(fd: int):
+    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+  def _unlock(fd: int):
+    fcntl.flock(fd, fcntl.LOCK_UN)
 
-  def __new__(cls, cache_root: str, folder: str):
-    if cls._instance is None:
-      cls._instance = super(FileContext, cls).__new__(cls)
 
-    cls._instance.set_context(cache_root, folder)
+HIDDEN_FOLDER = '.hidden'
+
+
+class FileContext:
+  # One context per thread of execution, ie. per Streamlit script run,
+  # so that concurrent sessions never see each other's chat folder
+  _instance: ContextVar = ContextVar('file_context', default=None)
 
-    return cls._instance
+  def __init__(self, cache_root: str, folder: str):
+    self.set_context(cache_root, folder)
 
   def set_context(self, cache_root: str, folder: str):
     self.context = dict(
@@ -30,8 +50,8 @@ class FileContext:
   @classmethod
   def get_instance(cls, *, cache_root: str = None, folder: str = None):
     if cache_root and folder:
-      return cls(cache_root, folder)
-    return cls._instance
+      cls._instance.set(cls(cache_root, folder))
+    return cls._instance.get()
 
 
 def create_cache_folder(cache_root: str, **kwargs):
@@ -60,7 +80,7 @@ def save_uploaded_files(cache_root: str, folder: str, files: List[io.BytesIO]):
     except Exception as ex:
       status = (False, type(ex).__name__, str(ex))
     else:
-      status = (True, )
+      status = (True, os.path.getsize(upload_path))
 
     file_status[file.name] = status
 
@@ -73,3 +93,33 @@ def list_files(cache_root: str, folder: str):
     for filename in os.listdir(os.path.join(cache_root, folder))
     if os.path.isfile(os.path.join(cache_root, folder, filename))
   ]
+
+
+@contextmanager
+def file_lock(lock_path: str, timeout: float, poll_interval: float = 0.1,
+              busy_message: Optional[str] = None) -> Iterator[None]:
+  '''Exclusive lock on `lock_path`, shared by all processes on the host.
+
+  Raises `TimeoutError` if the lock cannot be acquired within `timeout` seconds.
+  '''
+
+  fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+
+  try:
+    deadline = time.monotonic() + timeout
+    while True:
+      try:
+        _try_lock(fd)
+        break
+      except OSError:
+        if time.monotonic() >= deadline:
+          raise TimeoutError(busy_message or f'Timed out waiting for lock {lock_path}')
+        time.sleep(poll_interval)
+
+    try:
+      yield
+    finally:
+      _unlock(fd)
+
+  finally:
+    os.close(fd)
@@ -0,0 +1,121 @@
+from langchain_community.chat_message_histories import SQLChatMessageHistory
+from langchain_community.chat_message_histories.sql import BaseMessageConverter
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
+from sqlalchemy import Column, Integer, Text, inspect, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import declarative_base
+from typing import Any, List, Union
+
+from toolkit.database import is_schema_conflict
+from toolkit.tokens import cache_message_tokens, count_message_tokens
+
+import json
+import threading
+
+
+MESSAGE_TABLE = 'message_store'
+
+MessageBase = declarative_base()
+
+
+class MessageRecord(MessageBase):
+  __tablename__ = MESSAGE_TABLE
+
+  id = Column(Integer, primary_key=True)
+  session_id = Column(Text)
+  message = Column(Text)
+
+  tokens = Column(Integer)
+
+
+class TokenCountingConverter(BaseMessageConverter):
+  def __init__(self, model_name: str):
+    self.model_name = model_name
+
+  def from_sql_model(self, sql_message: Any) -> BaseMessage:
+    return messages_from_dict([json.loads(sql_message.message)])[0]
+
+  def to_sql_model(self, message: BaseMessage, session_id: str) -> Any:
+    return MessageRecord(
+      session_id=session_id,
+      message=json.dumps(message_to_dict(message)),
+      tokens=count_message_tokens(message, self.model_name),
+    )
+
+  def get_sql_model_class(self) -> Any:
+    return MessageRecord
+
+
+_migrated_engines = set()
+_migration_lock = threading.Lock()
+
+
+def create_message_table(engine: Engine):
+  '''Create the message table, or add the tokens column to a legacy one.
+
+  Histories are created per request, so the schema is checked once per
+  database. Tables or columns created concurrently by another process
+  are tolerated.
+  '''
+
+  engine_url = str(engine.url)
+  with _migration_lock:
+    if engine_url in _migrated_engines:
+      return
+
+    try:
+      MessageBase.metadata.create_all(engine)
+
+      columns = [c['name'] for c in inspect(engine).get_columns(MESSAGE_TABLE)]
+      if 'tokens' not in columns:
+        with engine.begin() as conn:
+          conn.execute(text(f'ALTER TABLE {MESSAGE_TABLE} ADD COLUMN tokens INTEGER'))
+
+    except OperationalError as ex:
+      if not is_schema_conflict(ex):
+        raise
+
+    _migrated_engines.add(engine_url)
+
+
+class TokenCountedChatMessageHistory(SQLChatMessageHistory):
+  '''SQL chat history that stores the token count next to each message.
+
+  Stored counts are loaded into the in-memory token cache together with
+  the messages, so that the prompt budget check does not tokenize the
+  history again. Rows written before token accounting are back-filled.
+  '''
+
+  def __init__(self, session_id: str, connection: Union[str, Engine], model_name: str):
+    super().__init__(
+      session_id, connection=connection,
+      custom_message_converter=TokenCountingConverter(model_name),
+    )
+    self.model_name = model_name
+
+  def _create_table_if_not_exists(self) -> None:
+    create_message_table(self.engine)
+    self._table_created = True
+
+  @property
+  def messages(self) -> List[BaseMessage]:
+    with self._make_sync_session() as session:
+      records = session.query(MessageRecord).where(
+        MessageRecord.session_id == self.session_id
+      ).order_by(MessageRecord.id.asc()).all()
+
+      messages, backfilled = [], False
+      for record in records:
+        message = self.converter.from_sql_model(record)
+        if record.tokens is None:
+          record.tokens = count_message_tokens(message, self.model_name)
+          backfilled = True
+        else:
+          cache_message_tokens(message, self.model_name, record.tokens)
+        messages.append(message)
+
+      if backfilled:
+        session.commit()
+
+    return messages
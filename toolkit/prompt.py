@@ -27,6 +27,9 @@ DEFAULT_TOOL_GUIDELINES = '''
 - (Code) Additionally, write to the console formatted messages about important contents or execution results.
 - (Code) Locally installed packages include `numpy`, `pandas`, `matplotlib`, `seaborn`, `scikit-learn`, `imbalanced-learn`.
 - (Code) Prioritize safe, reproducible, and efficient code practices.
+- (Code) Uploaded files are listed with their sizes. For other files, check `os.path.getsize` before loading.
+- (Code) For large files (ie. over 100 MB), never load the whole file with `pd.read_csv`. Instead, use `from toolkit import chunked`, which processes files in bounded memory.
+- (Code) `chunked` offers `read_chunks(path, chunksize, **read_csv_kwargs)`, `groupby_agg(path, by, columns, aggs=('sum', 'count', 'mean'))`, `value_counts(path, column)`, `describe(path)` and `reservoir_sample(path, n, seed)`. Pass `usecols` to read only the needed columns. Group keys and counted values are returned as strings.
 - (Tool) Before code execution, you should first save the generated code to a file.
 - (Tool) Code execution tool runs via command line, rather than interactive Jupyter Notebook.
 '''
@@ -0,0 +1,240 @@
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import BaseMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import LLMResult
+from langchain_core.tools import BaseTool
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence
+
+import hashlib
+import json
+import threading
+import tiktoken
+import time
+
+
+# Per-message framing overhead of the chat completions format, see
+# https://github.com/openai/openai-cookbook (How to count tokens with tiktoken)
+MESSAGE_OVERHEAD = 3
+REPLY_OVERHEAD = 3
+
+DEFAULT_ENCODING = 'o200k_base'
+CHARS_PER_TOKEN = 4
+TOKEN_CACHE_SIZE = 8192
+ENCODING_RETRY_INTERVAL = 60.0
+
+_encodings: Dict[str, tiktoken.Encoding] = {}
+_encoding_retry_at: Dict[str, float] = {}
+
+_token_cache: OrderedDict = OrderedDict()
+_token_cache_lock = threading.Lock()
+
+
+def get_encoding(model_name: str) -> Optional[tiktoken.Encoding]:
+  # Encodings are downloaded on first use, estimate from length when offline
+  # and retry the download after a while, rather than on every count
+  if model_name in _encodings:
+    return _encodings[model_name]
+  if time.monotonic() < _encoding_retry_at.get(model_name, 0.0):
+    return None
+
+  try:
+    try:
+      encoding = tiktoken.encoding_for_model(model_name)
+    except KeyError:
+      encoding = tiktoken.get_encoding(DEFAULT_ENCODING)
+  except Exception:
+    _encoding_retry_at[model_name] = time.monotonic() + ENCODING_RETRY_INTERVAL
+    return None
+
+  _encodings[model_name] = encoding
+  return encoding
+
+
+def count_text_tokens(text: str, model_name: str) -> int:
+  if not text:
+    return 0
+
+  encoding = get_encoding(model_name)
+  if encoding is None:
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+  return len(encoding.encode(text, disallowed_special=()))
+
+
+def _message_text(message: BaseMessage) -> str:
+  content = message.content
+  if isinstance(content, list):
+    content = '\n'.join(
+      part if isinstance(part, str) else part.get('text', '')
+      for part in content
+    )
+
+  tool_calls = getattr(message, 'tool_calls', None)
+  if tool_calls:
+    calls = [dict(name=call['name'], args=call['args']) for call in tool_calls]
+    content = '\n'.join([content, json.dumps(calls, ensure_ascii=False)])
+
+  return content
+
+
+def _message_key(message: BaseMessage, model_name: str) -> str:
+  # Digest of the text, so that cached tool outputs do not stay in memory
+  digest = hashlib.sha1(_message_text(message).encode('utf-8')).hexdigest()
+  return '\x00'.join([model_name, message.type, digest])
+
+
+def cache_message_tokens(message: BaseMessage, model_name: str, tokens: int):
+  key = _message_key(message, model_name)
+  with _token_cache_lock:
+    _token_cache[key] = tokens
+    _token_cache.move_to_end(key)
+    while len(_token_cache) > TOKEN_CACHE_SIZE:
+      _token_cache.popitem(last=False)
+
+
+def count_message_tokens(message: BaseMessage, model_name: str) -> int:
+  key = _message_key(message, model_name)
+  with _token_cache_lock:
+    if key in _token_cache:
+      _token_cache.move_to_end(key)
+      return _token_cache[key]
+
+  tokens = MESSAGE_OVERHEAD + count_text_tokens(_message_text(message), model_name)
+  cache_message_tokens(message, model_name, tokens)
+
+  return tokens
+
+
+def count_messages_tokens(messages: Sequence[BaseMessage], model_name: str) -> int:
+  return sum(count_message_tokens(m, model_name) for m in messages)
+
+
+def _split_turns(messages: List[BaseMessage]) -> List[List[BaseMessage]]:
+  turns = []
+  for message in messages:
+    if not turns or isinstance(message, HumanMessage):
+      turns.append([])
+    turns[-1].append(message)
+  return turns
+
+
+def _compact_observation(message: ToolMessage, keep_tokens: int, model_name: str):
+  if not isinstance(message.content, str):
+    return message
+
+  total = count_text_tokens(message.content, model_name)
+  if total <= keep_tokens:
+    return message
+
+  encoding = get_encoding(model_name)
+  if encoding is None:
+    head = message.content[:keep_tokens * CHARS_PER_TOKEN]
+  else:
+    head = encoding.decode(encoding.encode(message.content, disallowed_special=())[:keep_tokens])
+
+  content = f'{head}\n[... {total - keep_tokens} tokens compacted ...]'
+  return message.model_copy(update=dict(content=content))
+
+
+class PromptBudgetExceeded(RuntimeError):
+  '''The prompt does not fit the token budget, even after trimming.'''
+
+
+class PromptBudget:
+  '''Trim the chat history and compact the scratchpad before sending.
+
+  Observations of earlier agent steps are compacted first. If the prompt
+  still exceeds the budget, oldest turns of the history are dropped, so
+  that tool messages never lose their originating tool calls. As a last
+  resort, the newest observation is cut to the tokens still left.
+  '''
+
+  def __init__(self, model_name: str, max_tokens: int, system_prompt: str,
+               tools: Sequence[BaseTool] = (), observation_tokens: int = 256):
+    self.model_name = model_name
+    self.max_tokens = max_tokens
+    self.observation_tokens = observation_tokens
+    self.system_tokens = MESSAGE_OVERHEAD + count_text_tokens(system_prompt, model_name)
+
+    # Tool schemas are sent with every request, count them once
+    self.tool_tokens = sum(
+      count_text_tokens(json.dumps(convert_to_openai_tool(tool)), model_name)
+      for tool in tools
+    )
+
+  def __call__(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+    count_fn = lambda messages: count_messages_tokens(messages, self.model_name)
+
+    history: List[BaseMessage] = inputs.get('history', [])
+    scratchpad: List[BaseMessage] = list(inputs.get('agent_scratchpad', []))
+
+    fixed_tokens = sum([
+      self.system_tokens, self.tool_tokens, REPLY_OVERHEAD,
+      count_message_tokens(HumanMessage(content=inputs['message']), self.model_name),
+    ])
+    if fixed_tokens > self.max_tokens:
+      raise PromptBudgetExceeded(
+        f'System prompt and message exceed token budget: {fixed_tokens} > {self.max_tokens} tokens'
+      )
+
+    turns = _split_turns(history)
+    turn_tokens = [count_fn(turn) for turn in turns]
+    total = fixed_tokens + sum(turn_tokens) + count_fn(scratchpad)
+
+    newest = max(
+      (idx for idx, m in enumerate(scratchpad) if isinstance(m, ToolMessage)),
+      default=None,
+    )
+
+    if total > self.max_tokens:
+      scratchpad = [
+        _compact_observation(m, self.observation_tokens, self.model_name)
+        if isinstance(m, ToolMessage) and idx != newest else m
+        for idx, m in enumerate(scratchpad)
+      ]
+      total = fixed_tokens + sum(turn_tokens) + count_fn(scratchpad)
+
+    while turns and total > self.max_tokens:
+      turns.pop(0)
+      total -= turn_tokens.pop(0)
+
+    if total > self.max_tokens and newest is not None:
+      observation = scratchpad[newest]
+      other_tokens = total - count_message_tokens(observation, self.model_name)
+
+      # Shrink until it fits, the compaction note itself costs a few tokens
+      keep_tokens = count_text_tokens(_message_text(observation), self.model_name)
+      while total > self.max_tokens and keep_tokens > 0:
+        keep_tokens = max(0, keep_tokens - (total - self.max_tokens))
+        scratchpad[newest] = _compact_observation(observation, keep_tokens, self.model_name)
+        total = other_tokens + count_message_tokens(scratchpad[newest], self.model_name)
+
+    if total > self.max_tokens:
+      raise PromptBudgetExceeded(
+        f'Prompt exceeds token budget: {total} > {self.max_tokens} tokens'
+      )
+
+    history = [message for turn in turns for message in turn]
+    return dict(inputs, history=history, agent_scratchpad=scratchpad)
+
+
+class TokenUsageCallback(BaseCallbackHandler):
+  '''Accumulate token usage over a chat turn.'''
+
+  def __init__(self, model_name: str):
+    self.model_name = model_name
+    self.prompt_tokens = 0
+    self.completion_tokens = 0
+
+  def on_chat_model_start(self, serialized: Dict[str, Any],
+                          messages: List[List[BaseMessage]], **kwargs: Any):
+    for batch in messages:
+      self.prompt_tokens += REPLY_OVERHEAD + count_messages_tokens(batch, self.model_name)
+
+  def on_llm_end(self, response: LLMResult, **kwargs: Any):
+    for generations in response.generations:
+      for generation in generations:
+        message = getattr(generation, 'message', None)
+        text = _message_text(message) if message is not None else generation.text
+        self.completion_tokens += count_text_tokens(text, self.model_name)
@@ -9,6 +9,15 @@ import subprocess
 import sys
 
 
+# Project folder that contains the `toolkit` package, so that scripts can import its helpers
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _script_environment() -> Dict[str, str]:
+  pythonpath = [PROJECT_ROOT, os.environ.get('PYTHONPATH', '')]
+  return dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, pythonpath)))
+
+
 def _working_directory() -> str:
   context = FileContext.get_instance()
   if context is None:
@@ -49,14 +58,13 @@ def code_execution(path: str) -> Dict[str, str]:
     path: The path of the Python code to execute.
   '''
 
-  parent_proc_cwd = os.getcwd()
-  os.chdir(_working_directory())
-
   script_relpath = os.path.join(HIDDEN_FOLDER, path)
 
   try:
+    # Run in the chat folder, without changing the cwd shared by all sessions
     proc = subprocess.run(
       [sys.executable, script_relpath],
+      cwd=_working_directory(), env=_script_environment(),
       capture_output=True, text=True, check=True,
     )
     stdout = proc.stdout if proc.stdout else ''
@@ -74,8 +82,6 @@ def code_execution(path: str) -> Dict[str, str]:
       stdout='', stderr='',
     )
 
-  os.chdir(parent_proc_cwd)
-
   return result.model_dump()
 
 